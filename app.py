@@ -1,10 +1,23 @@
 import os
 import re
+import atexit
+import functools
+import shutil
+import hashlib
 import tempfile
+import threading
+import time
+import zlib
 import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from operator import itemgetter
 from pathlib import Path
 
+from cachelib.file import FileSystemCache
 from flask import Flask, render_template, request, session, redirect, url_for
+from flask_session import Session
 
 # ---------------------------------------------------------
 # Paths and basic setup
@@ -13,10 +26,19 @@ BASE_DIR = Path(__file__).resolve().parent
 BIN_DIR = BASE_DIR / "bin"
 # NOTE: binary is now named "unix" inside bin/
 SIMFDS_PATH = BIN_DIR / "unix"
+# Resolved once at import; the binary is part of the deployed image.
+_SIMFDS_AVAILABLE = SIMFDS_PATH.exists()
 
 app = Flask(__name__)
 # For session storage of last system text (local dev, replace in production)
 app.secret_key = "jaguar-simfds-secret-key"
+# Keep session data server-side so the cookie carries only the session id,
+# not the whole system text.
+app.config["SESSION_TYPE"] = "cachelib"
+app.config["SESSION_CACHELIB"] = FileSystemCache(
+    cache_dir=str(BASE_DIR / ".sessions"), threshold=500
+)
+Session(app)
 
 DEFAULT_SYSTEM_TEXT = (
     "NUMBER OF VARIABLES: 3\n"
@@ -26,6 +48,54 @@ DEFAULT_SYSTEM_TEXT = (
     "x3 = x2 + x1\n"
 )
 
+# Graphviz dot, resolved to an absolute path once. subprocess only uses
+# posix_spawn() (rather than fork+exec, which copies the worker's page
+# tables) for an executable given by path; on Python 3.13 that holds with
+# the default close_fds=True.
+DOT_PATH = shutil.which("dot") or "dot"
+# Upper bound (seconds) on a single dot render
+DOT_TIMEOUT = 10
+# How long (seconds) a result with a timed-out render stays cached before
+# the input is tried again; the timeout may have been load, not the input.
+DOT_TIMEOUT_CACHE_TTL = 300
+
+# In-process cache of computed artifacts, keyed on sha256(system_text).
+# Identical submissions (and the /graph/<kind> round-trip) skip simFDS and dot.
+# Failed renders are cached too (as ""), so a pathological input is only
+# tried, and logged, once; results with a dot timeout are cached for
+# DOT_TIMEOUT_CACHE_TTL only. Entries are zlib-compressed and the LRU is bounded
+# by their total compressed size rather than by entry count.
+ARTIFACT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_artifact_cache = OrderedDict()
+_artifact_cache_bytes = 0
+_artifact_cache_lock = threading.Lock()
+
+# Entry count for the dependency-graph memo caches
+DEPENDENCY_CACHE_SIZE = 256
+
+# Idle scratch directories for simFDS runs (see _scratch_dir)
+_scratch_dirs = []
+_scratch_lock = threading.Lock()
+
+# /graph/<kind> -> (index into the artifacts tuple, page title)
+GRAPH_KINDS = {
+    "statespace": (0, "State space – Jaguar"),
+    "dependency": (1, "Dependency graph – Jaguar"),
+}
+
+# Precompiled patterns for parsing the system text and state-space DOT
+_LINE_RE = re.compile(r"^\s*(x\d+)\s*=(.*)$")
+_VAR_RE = re.compile(r"\b(x\d+)\b")
+# A whole state-space edge line (plus its LF or CRLF newline), e.g.
+#   "0 0 0 0" -> "0 0 0 1";
+_EDGE_LINE_RE = re.compile(
+    r'^([^\r\n]*?"([01 ]+)"[ \t]*->[ \t]*"[01 ]+"[^\r\n]*)\r?\n?', re.MULTILINE
+)
+_CLOSE_LINE_RE = re.compile(r"^([^\S\r\n]*\}[^\S\r\n]*)\r?$\n?", re.MULTILINE)
+
+# Digit -> Unicode subscript table for node labels
+_SUB_TABLE = str.maketrans("0123456789", "₀₁₂₃₄₅₆₇₈₉")
+
 
 # ---------------------------------------------------------
 # Helpers
@@ -41,29 +111,43 @@ def run_command(cmd, cwd):
     return proc.returncode, proc.stdout, proc.stderr
 
 
+def run_dot(src: str) -> str:
+    """
+    Render DOT source to SVG by piping it through `dot -Tsvg`.
+    Returns the SVG text, or "" if dot fails (including crashes such as
+    SIGSEGV, reported as a negative rc). Running past DOT_TIMEOUT may just
+    mean a busy box, so that raises subprocess.TimeoutExpired instead and
+    callers cache it only briefly.
+    """
+    try:
+        proc = subprocess.run(
+            [DOT_PATH, "-Tsvg"],
+            input=src,
+            text=True,
+            capture_output=True,
+            timeout=DOT_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        print(f"dot timed out after {DOT_TIMEOUT}s", flush=True)
+        raise
+    if proc.returncode != 0:
+        print(
+            f"dot failed with rc={proc.returncode}\nSTDERR:\n{proc.stderr}",
+            flush=True,
+        )
+        return ""
+    return proc.stdout
+
+
 def _subscript_label(var_name: str) -> str:
     """
     Convert 'x1' -> 'x₁', 'x12' -> 'x₁₂' using Unicode subscripts.
     If the name does not match x + digits, return it unchanged.
     """
-    m = re.fullmatch(r"x(\d+)", var_name)
-    if not m:
-        return var_name
-
-    digits = m.group(1)
-    subs = {
-        "0": "₀",
-        "1": "₁",
-        "2": "₂",
-        "3": "₃",
-        "4": "₄",
-        "5": "₅",
-        "6": "₆",
-        "7": "₇",
-        "8": "₈",
-        "9": "₉",
-    }
-    return "x" + "".join(subs.get(d, d) for d in digits)
+    digits = var_name[1:]
+    if var_name.startswith("x") and digits.isdecimal():
+        return "x" + digits.translate(_SUB_TABLE)
+    return var_name
 
 
 def build_dependency_dot(system_text: str) -> str:
@@ -76,22 +160,17 @@ def build_dependency_dot(system_text: str) -> str:
     """
     edges = set()
     nodes = set()
-    assign_re = re.compile(r"^\s*(x\d+)\s*=")
-    var_re = re.compile(r"\b(x\d+)\b")
 
     for line in system_text.splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        m = assign_re.match(line)
+        # Blank and '#' comment lines simply fail to match.
+        m = _LINE_RE.match(line)
         if not m:
             continue
 
-        target = m.group(1)  # xk on the left
+        target, rhs = m.group(1), m.group(2)  # xk on the left
         nodes.add(target)
 
-        rhs = line.split("=", 1)[1]
-        for var in var_re.findall(rhs):
+        for var in _VAR_RE.findall(rhs):
             nodes.add(var)
             if var != target:
                 # NOTE: flipped direction: x_k -> x_i
@@ -100,24 +179,42 @@ def build_dependency_dot(system_text: str) -> str:
     if not edges and not nodes:
         return ""
 
-    out_lines = [
-        "digraph dep {",
-        "  rankdir=LR;",
-        '  node [shape=ellipse, fontname="Monaco", fontsize=11];',
-        '  edge [fontname="Monaco", fontsize=9];',
-    ]
+    header = "\n".join(
+        (
+            "digraph dep {",
+            "  rankdir=LR;",
+            '  node [shape=ellipse, fontname="Monaco", fontsize=11];',
+            '  edge [fontname="Monaco", fontsize=9];',
+        )
+    )
 
     # Node declarations with math-style labels x₁, x₂, ...
-    for v in sorted(nodes):
-        label = _subscript_label(v)
-        out_lines.append(f'  "{v}" [label="{label}"];')
+    node_block = "\n".join(
+        f'  "{v}" [label="{_subscript_label(v)}"];' for v in sorted(nodes)
+    )
 
     # Edges x_k -> x_i
-    for u, v in sorted(edges):
-        out_lines.append(f'  "{u}" -> "{v}";')
+    edge_block = "\n".join(f'  "{u}" -> "{v}";' for u, v in sorted(edges))
+
+    # A self-loop-only system has no edges; skip the empty block.
+    return "\n".join(block for block in (header, node_block, edge_block, "}") if block)
 
-    out_lines.append("}")
-    return "\n".join(out_lines)
+
+@functools.lru_cache(maxsize=DEPENDENCY_CACHE_SIZE)
+def _dependency_dot(canonical_text: str) -> str:
+    """build_dependency_dot, memoized on the canonical system text."""
+    return build_dependency_dot(canonical_text)
+
+
+@functools.lru_cache(maxsize=DEPENDENCY_CACHE_SIZE)
+def _dependency_svg(dep_dot_src: str) -> str:
+    """
+    Rendered dependency graph, memoized on its DOT source. Systems that
+    differ only in ways the dependency graph can't see (state count,
+    operators) share one render. A dot timeout propagates, so it is not
+    memoized here; the artifact cache holds it for DOT_TIMEOUT_CACHE_TTL.
+    """
+    return run_dot(dep_dot_src)
 
 
 def _reorder_statespace_dot(dot_source: str) -> str:
@@ -128,108 +225,242 @@ def _reorder_statespace_dot(dot_source: str) -> str:
     Lines of interest look like:
         "0 0 0 0" -> "0 0 0 1";
     """
-    lines = dot_source.splitlines()
-    edge_pattern = re.compile(r'"([01 ]+)"\s*->\s*"[01 ]+"')
-
-    edge_lines = []
-    prefix_lines = []
-    closing_line = ""
-
-    for line in lines:
-        stripped = line.strip()
-        if stripped == "}":
-            closing_line = line
-            continue
-
-        if edge_pattern.search(line):
-            edge_lines.append(line)
-        else:
-            prefix_lines.append(line)
-
-    def key_for_line(line: str):
-        m = edge_pattern.search(line)
-        if not m:
-            return (0, 0)
-        raw = m.group(1)
-        bits = raw.replace(" ", "")
-        weight = bits.count("1")
+    # Pull the edge lines out in one pass; everything between them is kept.
+    edges = []
+    gaps = []
+    pos = 0
+    for m in _EDGE_LINE_RE.finditer(dot_source):
+        gaps.append(dot_source[pos : m.start()])
+        pos = m.end()
+        bits = m.group(2).replace(" ", "")
         value = int(bits, 2) if bits else 0
-        return (weight, value)
+        weight = value.bit_count()
+        edges.append((weight, value, m.group(1)))
+    gaps.append(dot_source[pos:])
 
-    edge_lines_sorted = sorted(edge_lines, key=key_for_line)
+    # The closing brace goes back after the edges.
+    rest = "".join(gaps)
+    closing_lines = _CLOSE_LINE_RE.findall(rest)
+    closing_line = closing_lines[-1] if closing_lines else ""
+    if closing_lines:
+        rest = _CLOSE_LINE_RE.sub("", rest)
 
-    new_lines = prefix_lines + edge_lines_sorted
+    edges.sort(key=itemgetter(0, 1))
+
+    new_lines = rest.splitlines()
+    new_lines.extend(line for _, _, line in edges)
     if closing_line:
         new_lines.append(closing_line)
 
     return "\n".join(new_lines)
 
 
-def compute_system_artifacts(system_text: str):
+def _canonical_system_text(system_text: str) -> str:
+    """
+    Drop blank lines, '#' comment lines and surrounding whitespace.
+    This is both the cache key input and what simFDS is given, so two
+    texts sharing a key always get the same simFDS run.
+    """
+    return "\n".join(
+        stripped
+        for stripped in (line.strip() for line in system_text.splitlines())
+        if stripped and not stripped.startswith("#")
+    )
+
+
+def _system_hash(system_text: str) -> str:
+    """
+    Content hash of the canonical system text, used as the artifact cache
+    key, so whitespace and comment edits still hit the cache.
+    """
+    canonical = _canonical_system_text(system_text)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str, slots=None):
     """
-    Given system_text, run simFDS and Graphviz once and return:
+    Return cached artifacts for key (marking them recently used), or None
+    if absent or expired. If slots is given, only those tuple positions are
+    decompressed and returned, in that order.
+    """
+    global _artifact_cache_bytes
+
+    with _artifact_cache_lock:
+        entry = _artifact_cache.get(key)
+        if entry is None:
+            return None
+        packed, size, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del _artifact_cache[key]
+            _artifact_cache_bytes -= size
+            return None
+        _artifact_cache.move_to_end(key)
+    if slots is not None:
+        packed = [packed[slot] for slot in slots]
+    # Decompress outside the lock
+    return tuple(zlib.decompress(blob).decode("utf-8") for blob in packed)
+
+
+def _cache_put(key: str, artifacts, ttl: float | None = None) -> None:
+    """
+    Store artifacts under key, evicting the least recently used entries
+    until the cache fits in ARTIFACT_CACHE_MAX_BYTES. An entry too big to
+    fit on its own is not stored, rather than flushing everything else.
+    With ttl (seconds), the entry expires after that long.
+    """
+    global _artifact_cache_bytes
+
+    # Level 1: graphviz SVG still shrinks several-fold, at little CPU cost
+    packed = tuple(zlib.compress(text.encode("utf-8"), 1) for text in artifacts)
+    size = sum(len(blob) for blob in packed)
+    if size > ARTIFACT_CACHE_MAX_BYTES:
+        print(
+            f"artifacts for {key} too large to cache ({size} bytes compressed)",
+            flush=True,
+        )
+        return
+
+    expires_at = time.monotonic() + ttl if ttl is not None else None
+
+    with _artifact_cache_lock:
+        old = _artifact_cache.pop(key, None)
+        if old is not None:
+            _artifact_cache_bytes -= old[1]
+        _artifact_cache[key] = (packed, size, expires_at)
+        _artifact_cache_bytes += size
+        while _artifact_cache_bytes > ARTIFACT_CACHE_MAX_BYTES:
+            _, (_, evicted_size, _) = _artifact_cache.popitem(last=False)
+            _artifact_cache_bytes -= evicted_size
+
+
+def compute_system_artifacts(system_text: str, key: str | None = None, slots=None):
+    """
+    Cached front end for _compute_system_artifacts.
+    Results are keyed on the content hash of system_text (pass key if it
+    is already known) and kept in a compressed LRU of at most
+    ARTIFACT_CACHE_MAX_BYTES. Pass slots to get just those positions of
+    the artifacts tuple, so a hit only decompresses what is needed.
+    """
+    if key is None:
+        key = _system_hash(system_text)
+    artifacts = _cache_get(key, slots)
+    if artifacts is None:
+        artifacts, timed_out = _compute_system_artifacts(system_text)
+        _cache_put(key, artifacts, DOT_TIMEOUT_CACHE_TTL if timed_out else None)
+        if slots is not None:
+            artifacts = tuple(artifacts[slot] for slot in slots)
+    return artifacts
+
+
+@contextmanager
+def _scratch_dir():
+    """
+    Borrow a scratch directory for one simFDS run.
+    Directories are reused across requests (one per concurrent request)
+    instead of creating and deleting a fresh temp dir each time; outputs
+    left by the previous run are cleared first.
+    """
+    with _scratch_lock:
+        workdir = _scratch_dirs.pop() if _scratch_dirs else None
+
+    if workdir is None:
+        workdir = Path(tempfile.mkdtemp(prefix="simfds-"))
+        atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    else:
+        for leftover in workdir.glob("system-*"):
+            leftover.unlink(missing_ok=True)
+
+    try:
+        yield workdir
+    finally:
+        with _scratch_lock:
+            _scratch_dirs.append(workdir)
+
+
+def _run_simfds(workdir: Path) -> None:
+    """Run simFDS on workdir/system.pds; outputs land next to it."""
+    if _SIMFDS_AVAILABLE:
+        rc, out, err = run_command([str(SIMFDS_PATH), "system"], cwd=workdir)
+        if rc != 0:
+            # Log but don't crash; state space will remain empty.
+            print(
+                f"simFDS failed with rc={rc}\nSTDOUT:\n{out}\nSTDERR:\n{err}",
+                flush=True,
+            )
+    else:
+        # On Render, if you see this in logs, the binary isn't being seen.
+        print(f"simFDS binary not found at {SIMFDS_PATH}", flush=True)
+
+
+def _render_result(future):
+    """SVG from a run_dot future, or None if dot timed out."""
+    try:
+        return future.result()
+    except subprocess.TimeoutExpired:
+        return None
+
+
+def _compute_system_artifacts(system_text: str):
+    """
+    Given system_text, run simFDS (on its canonical form) and Graphviz
+    once and return:
       statespace_svg (str),
       depgraph_svg (str),
       limitcycles_text (str),
       statespace_dot_text (str, reordered)
+    as a tuple, plus a flag that is True when a dot render timed out (its
+    SVG is then "") so the result should only be cached briefly.
     All SVGs are returned as inline text, not saved to disk.
+
+    simFDS and the dependency graph are independent, so they run side by
+    side, and each dot render starts as soon as its DOT source is ready.
     """
     statespace_svg = ""
     depgraph_svg = ""
     limitcycles_text = ""
     statespace_dot_text = ""
 
-    with tempfile.TemporaryDirectory() as tmpdir_str:
-        tmpdir = Path(tmpdir_str)
-        pds_path = tmpdir / "system.pds"
-        pds_path.write_text(system_text, encoding="utf-8")
-
-        # Run simFDS if binary exists
-        if SIMFDS_PATH.exists():
-            rc, out, err = run_command([str(SIMFDS_PATH), "system"], cwd=tmpdir)
-            if rc != 0:
-                # Log but don't crash; state space will remain empty.
-                print(
-                    f"simFDS failed with rc={rc}\nSTDOUT:\n{out}\nSTDERR:\n{err}",
-                    flush=True,
-                )
-        else:
-            # On Render, if you see this in logs, the binary isn't being seen.
-            print(f"simFDS binary not found at {SIMFDS_PATH}", flush=True)
-
-        # State space DOT -> SVG
-        ss_dot = tmpdir / "system-statespace.dot"
-        ss_svg = tmpdir / "system-statespace.svg"
+    canonical = _canonical_system_text(system_text)
+
+    with _scratch_dir() as workdir, ThreadPoolExecutor(max_workers=3) as pool:
+        pds_path = workdir / "system.pds"
+        pds_path.write_text(canonical + "\n", encoding="utf-8")
+
+        simfds_future = pool.submit(_run_simfds, workdir)
+
+        # Dependency graph from system_text; never touches the filesystem
+        dep_svg_future = None
+        dep_dot_src = _dependency_dot(canonical)
+        if dep_dot_src:
+            dep_svg_future = pool.submit(_dependency_svg, dep_dot_src)
+
+        simfds_future.result()
+
+        # State space DOT (written by simFDS) -> SVG
+        ss_svg_future = None
+        ss_dot = workdir / "system-statespace.dot"
         if ss_dot.exists():
             raw_dot = ss_dot.read_text(encoding="utf-8")
+            ss_svg_future = pool.submit(run_dot, raw_dot)
             statespace_dot_text = _reorder_statespace_dot(raw_dot)
 
-            rc, _, _ = run_command(
-                ["dot", "-Tsvg", "-o", str(ss_svg), str(ss_dot)],
-                cwd=tmpdir,
-            )
-            if rc == 0 and ss_svg.exists():
-                statespace_svg = ss_svg.read_text(encoding="utf-8")
-
         # Limit cycles text
-        lc_txt = tmpdir / "system-limitcycles.txt"
+        lc_txt = workdir / "system-limitcycles.txt"
         if lc_txt.exists():
             limitcycles_text = lc_txt.read_text(encoding="utf-8")
 
-        # Dependency graph from system_text
-        dep_dot_src = build_dependency_dot(system_text)
-        if dep_dot_src:
-            dep_dot = tmpdir / "system-dep.dot"
-            dep_svg = tmpdir / "system-dep.svg"
-            dep_dot.write_text(dep_dot_src, encoding="utf-8")
-            rc, _, _ = run_command(
-                ["dot", "-Tsvg", "-o", str(dep_svg), str(dep_dot)],
-                cwd=tmpdir,
-            )
-            if rc == 0 and dep_svg.exists():
-                depgraph_svg = dep_svg.read_text(encoding="utf-8")
+        if ss_svg_future is not None:
+            statespace_svg = _render_result(ss_svg_future)
+        if dep_svg_future is not None:
+            depgraph_svg = _render_result(dep_svg_future)
+
+    # A timed-out render shows as empty until its cache entry expires
+    timed_out = statespace_svg is None or depgraph_svg is None
+    statespace_svg = statespace_svg or ""
+    depgraph_svg = depgraph_svg or ""
 
-    return statespace_svg, depgraph_svg, limitcycles_text, statespace_dot_text
+    artifacts = (statespace_svg, depgraph_svg, limitcycles_text, statespace_dot_text)
+    return artifacts, timed_out
 
 
 # ---------------------------------------------------------
@@ -245,14 +476,16 @@ def index():
 
     if request.method == "POST":
         system_text = request.form.get("system_text", "").strip() or DEFAULT_SYSTEM_TEXT
+        system_hash = _system_hash(system_text)
         session["system_text"] = system_text
+        session["system_hash"] = system_hash
 
         (
             statespace_svg,
             depgraph_svg,
             limitcycles_text,
             statespace_dot_text,
-        ) = compute_system_artifacts(system_text)
+        ) = compute_system_artifacts(system_text, system_hash)
 
     return render_template(
         "index.html",
@@ -268,21 +501,18 @@ def index():
 def graph_view(kind):
     """
     Fullscreen view for a single graph on an infinite white canvas.
-    Recomputes from the last system_text stored in the session.
+    Serves the SVG computed by the preceding POST straight from the cache,
+    via the hash stored in the session; only recomputes on a cache miss.
+    A cached failure (empty SVG) redirects without rerunning anything.
     """
-    system_text = session.get("system_text", DEFAULT_SYSTEM_TEXT)
-
-    if kind not in {"statespace", "dependency"}:
+    if kind not in GRAPH_KINDS:
         return redirect(url_for("index"))
 
-    statespace_svg, depgraph_svg, _, _ = compute_system_artifacts(system_text)
-
-    if kind == "statespace":
-        svg = statespace_svg
-        title = "State space – Jaguar"
-    else:
-        svg = depgraph_svg
-        title = "Dependency graph – Jaguar"
+    slot, title = GRAPH_KINDS[kind]
+    system_text = session.get("system_text", DEFAULT_SYSTEM_TEXT)
+    (svg,) = compute_system_artifacts(
+        system_text, session.get("system_hash"), slots=(slot,)
+    )
 
     if not svg:
         return redirect(url_for("index"))